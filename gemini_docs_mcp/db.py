@@ -0,0 +1,113 @@
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+from sqlite_utils import Database
+from .config import DB_PATH
+
+logger = logging.getLogger(__name__)
+
+READ_POOL_SIZE = 4
+
+# Applied once per connection when it is opened
+READER_PRAGMAS = """
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-65536;
+PRAGMA temp_store=MEMORY;
+PRAGMA busy_timeout=5000;
+"""
+
+WRITER_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-65536;
+PRAGMA busy_timeout=5000;
+"""
+
+class ConnectionPool:
+    """
+    A fixed-size pool of read-only SQLite connections shared by the tool handlers.
+    Each connection is wrapped in a long-lived sqlite_utils Database, so neither the
+    connection setup nor the wrapper's own setup is repeated per tool call.
+    """
+
+    def __init__(self, path: str, size: int = READ_POOL_SIZE):
+        self._path = path
+        self._size = size
+        self._idle: "queue.Queue[Database]" = queue.Queue(maxsize=size)
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> Database:
+        # Readers open the file read-only; with WAL they never block the writer or each other
+        uri = Path(self._path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.executescript(READER_PRAGMAS)
+        return Database(conn)
+
+    def _try_open(self) -> Optional[Database]:
+        """Opens a new connection if the pool has not reached its size yet."""
+        with self._lock:
+            if self._opened >= self._size:
+                return None
+            self._opened += 1
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def warm(self) -> None:
+        """Opens all connections up front so the first tool calls don't pay for it."""
+        while (db := self._try_open()) is not None:
+            self._idle.put(db)
+        logger.info(f"SQLite read pool ready with {self._size} connections")
+
+    @contextmanager
+    def acquire(self) -> Iterator[Database]:
+        """Borrows a connection for the duration of the block."""
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            db = self._try_open() or self._idle.get()
+        try:
+            yield db
+        finally:
+            self._idle.put(db)
+
+    def close(self) -> None:
+        """Closes all idle connections."""
+        while True:
+            try:
+                db = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            db.close()
+            with self._lock:
+                self._opened -= 1
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide read pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+def connect_writer() -> sqlite3.Connection:
+    """Opens the single write connection used by ingestion."""
+    # Autocommit mode: writers open their own transactions with BEGIN IMMEDIATE.
+    # Ingestion hands the connection to worker threads, one batch at a time
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+    conn.executescript(WRITER_PRAGMAS)
+    return conn
@@ -1,12 +1,16 @@
 import asyncio
 import hashlib
 import logging
+import os
+import re
+import sys
 from datetime import datetime, timezone
-from typing import List, Tuple
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit, urlunsplit
 import httpx
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from sqlite_utils import Database
-from .config import DB_PATH
+from .db import connect_writer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -14,41 +18,53 @@ logger = logging.getLogger(__name__)
 
 LLMS_TXT_URL = "https://ai.google.dev/gemini-api/docs/llms.txt"
 MAX_CONCURRENT_REQUESTS = 20
+WRITE_BATCH_SIZE = 32
+PARSE_WORKERS = min(os.cpu_count() or 1, 4)
+PIPELINE_QUEUE_SIZE = 64
+SCHEMA_VERSION = 3
 
-async def fetch_url(client: httpx.AsyncClient, url: str, retries: int = 3) -> str:
-    """Fetches content from a URL and extracts text from HTML."""
+DOCS_URL_PREFIX = "https://ai.google.dev/gemini-api/docs/"
+MARKDOWN_SUFFIXES = (".md", ".md.txt")
+
+# Runs of two or more spaces/tabs separate phrases within an extracted line
+_MULTISPACE_RE = re.compile(r'[ \t]{2,}')
+_NBSP_TABLE = str.maketrans({'\xa0': ' '})
+# Any whitespace run, collapsed before hashing
+_WS_RE = re.compile(r'\s+')
+
+# Updates fire the FTS triggers created by enable_fts(create_triggers=True)
+UPSERT_DOC_SQL = """
+INSERT INTO docs (url, title, content, content_hash, last_updated) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(url) DO UPDATE SET
+    title = excluded.title,
+    content = excluded.content,
+    content_hash = excluded.content_hash,
+    last_updated = excluded.last_updated
+"""
+
+# Markdown list entries of the form "- [Title](url)"; the title ends at the first "]("
+_LINK_RE = re.compile(r'^[ \t]*- \[(.*?)\]\(([^)]*)\)', re.MULTILINE)
+
+async def fetch_page(client: httpx.AsyncClient, url: str, retries: int = 3) -> Tuple[str, bool]:
+    """Fetches the body of a URL. Returns the body and whether it is HTML that still needs parsing."""
     for attempt in range(retries):
         try:
-            response = await client.get(url, follow_redirects=True, timeout=30.0)
+            response = await client.get(url, follow_redirects=True)
             response.raise_for_status()
-            
-            # Use BeautifulSoup to extract text if it's HTML
-            if "text/html" in response.headers.get("content-type", ""):
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Remove script and style elements
-                for script_or_style in soup(["script", "style", "header", "footer", "nav"]):
-                    script_or_style.decompose()
-                    
-                text = soup.get_text(separator='\n')
-                
-                # Break into lines and remove leading/trailing space on each
-                lines = (line.strip() for line in text.splitlines())
-                # Break multi-headlines into a line each
-                chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                # Drop blank lines
-                text = '\n'.join(chunk for chunk in chunks if chunk)
-                return text
-                
-            return response.text
+            # Markdown/plain text is stored as-is; only HTML goes through the parse stage
+            return response.text, "text/html" in response.headers.get("content-type", "")
         except httpx.HTTPStatusError as e:
             error_msg = f"HTTP {e.response.status_code}: {e.response.reason_phrase}"
+            if e.response.is_client_error:
+                # A missing or forbidden page won't appear on retry
+                logger.warning(f"Error fetching {url}: {error_msg}")
+                return "", False
             if attempt < retries - 1:
                 logger.warning(f"Error fetching {url} (attempt {attempt + 1}/{retries}): {error_msg}. Retrying...")
                 await asyncio.sleep(2 ** attempt)  # Exponential backoff
             else:
                 logger.error(f"Error fetching {url} after {retries} attempts: {error_msg}")
-                return ""
+                return "", False
         except httpx.RequestError as e:
             error_msg = f"Request error: {str(e) or type(e).__name__}"
             if attempt < retries - 1:
@@ -56,93 +72,238 @@ async def fetch_url(client: httpx.AsyncClient, url: str, retries: int = 3) -> st
                 await asyncio.sleep(2 ** attempt)  # Exponential backoff
             else:
                 logger.error(f"Error fetching {url} after {retries} attempts: {error_msg}")
-                return ""
+                return "", False
         except Exception as e:
             error_msg = f"{type(e).__name__}: {str(e) or 'Unknown error'}"
-            logger.error(f"Error parsing {url}: {error_msg}")
-            return ""
-    
-    return ""
+            logger.error(f"Error fetching {url}: {error_msg}")
+            return "", False
+
+    return "", False
+
+def html_to_text(html: str) -> str:
+    """Extracts the readable text from an HTML page using selectolax (lexbor, C)."""
+    tree = LexborHTMLParser(html)
+
+    # Remove script and style elements
+    for script_or_style in tree.css("script, style, header, footer, nav"):
+        script_or_style.decompose()
+
+    text = tree.root.text(separator='\n') if tree.root else ""
+
+    # Normalize non-breaking spaces and break multi-headlines into a line each
+    text = _MULTISPACE_RE.sub('\n', text.translate(_NBSP_TABLE))
+    # Remove leading/trailing space on each line and drop blank lines
+    return '\n'.join(filter(None, (line.strip() for line in text.splitlines())))
+
+async def fetch_url(client: httpx.AsyncClient, url: str, retries: int = 3) -> str:
+    """Fetches content from a URL and extracts text from HTML."""
+    body, is_html = await fetch_page(client, url, retries)
+    return html_to_text(body) if body and is_html else body
 
 def parse_llms_txt(content: str) -> List[Tuple[str, str]]:
     """Parses llms.txt content to extract titles and URLs."""
-    links = []
-    for line in content.splitlines():
-        line = line.strip()
-        if line.startswith("- [") and "](" in line and ")" in line:
-            try:
-                title_part, url_part = line.split("](", 1)
-                title = title_part[3:].strip()
-                url = url_part.split(")")[0].strip()
-                links.append((title, url))
-            except ValueError:
-                logger.warning(f"Could not parse line: {line}")
-    
-    return links
+    return [(title.strip(), url.strip()) for title, url in _LINK_RE.findall(content)]
+
+def to_markdown_url(url: str) -> str:
+    """
+    Points a docs page at its .md.txt sibling so it can be stored without HTML parsing.
+    Only the path is rewritten; URLs outside the docs pages are returned unchanged.
+    """
+    if not url.startswith(DOCS_URL_PREFIX):
+        return url
+    scheme, netloc, path, query, _ = urlsplit(url)
+    path = path.rstrip("/")
+    # The docs index itself has no sibling (".../docs/" is not ".../docs.md.txt")
+    if path.endswith(MARKDOWN_SUFFIXES) or path + "/" == urlsplit(DOCS_URL_PREFIX).path:
+        return url
+    return urlunsplit((scheme, netloc, path + ".md.txt", query, ""))
+
+def canonical(text: str) -> str:
+    """Collapses all whitespace runs so formatting-only changes don't count as content changes."""
+    return _WS_RE.sub(' ', text).strip()
 
 def get_content_hash(content: str) -> str:
-    """Calculates SHA256 hash of content."""
-    return hashlib.sha256(content.encode('utf-8')).hexdigest()
-
-async def process_link(client: httpx.AsyncClient, db: Database, title: str, url: str, semaphore: asyncio.Semaphore):
-    """Processes a single link: fetch, hash, and upsert if changed."""
-    async with semaphore:
-        # Check if update is needed
-        current_hash = None
+    """Calculates SHA256 hash of the canonicalized content. Only used for change detection, not security."""
+    return hashlib.sha256(canonical(content).encode('utf-8'), usedforsecurity=False).hexdigest()
+
+def prepare_page(url: str, body: str, is_html: bool) -> Tuple[str, str, str]:
+    """CPU-bound part of processing a page: extract text and hash it. Returns (doc_url, content, hash)."""
+    if is_html:
+        logger.debug(f"Extracting text from HTML for {url}")
+        content = html_to_text(body)
+    else:
+        logger.debug(f"Using plain text body for {url}")
+        content = body
+    return url.replace(".md.txt", ""), content, get_content_hash(content)
+
+async def fetch_worker(client: httpx.AsyncClient, links: asyncio.Queue, pages: asyncio.Queue):
+    """
+    Fetch stage: downloads links until the sentinel and passes the bodies on for parsing.
+    Tries the page's markdown sibling first and falls back to the page itself.
+    """
+    while (link := await links.get()) is not None:
+        title, url = link
+        markdown_url = to_markdown_url(url)
+        body, is_html = await fetch_page(client, markdown_url)
+        if not body and markdown_url != url:
+            logger.info(f"No markdown version of {url}, fetching the page itself")
+            body, is_html = await fetch_page(client, url)
+        if body:
+            await pages.put((title, url, body, is_html))
+
+async def parse_worker(pages: asyncio.Queue, results: asyncio.Queue, existing_hashes: Dict[str, str]):
+    """Parse stage: extracts and hashes pages off the event loop, passing changed ones to the writer."""
+    while (page := await pages.get()) is not None:
+        title, url, body, is_html = page
         try:
-            row = db["docs"].get(url)
-            current_hash = row["content_hash"]
-        except Exception: # Row not found
-            pass
+            doc_url, content, new_hash = await asyncio.to_thread(prepare_page, url, body, is_html)
+        except Exception as e:
+            error_msg = f"{type(e).__name__}: {str(e) or 'Unknown error'}"
+            logger.error(f"Error parsing {url}: {error_msg}")
+            continue
 
-        content = await fetch_url(client, url)
         if not content:
-            return
-
-        new_hash = get_content_hash(content)
-
-        if new_hash != current_hash:
-            logger.info(f"Updating {url}")
-            db["docs"].upsert({
-                "url": url.replace(".md.txt", ""),
-                "title": title,
-                "content": content,
-                "content_hash": new_hash,
-                "last_updated": datetime.now(timezone.utc).isoformat()
-            }, pk="url")
+            continue
+        if new_hash != existing_hashes.get(doc_url):
+            logger.info(f"Updating {doc_url}")
+            await results.put((title, doc_url, content, new_hash))
         else:
-            logger.debug(f"No changes for {url}")
+            logger.debug(f"No changes for {doc_url}")
+
+def write_batch(db: Database, batch: List[Tuple[str, str, str, str]]):
+    """Upserts a batch of changed pages in one transaction."""
+    now = datetime.now(timezone.utc).isoformat()
+    with db.conn:
+        # Take the write lock up front rather than upgrading a read lock mid-batch
+        db.conn.execute("BEGIN IMMEDIATE")
+        db.conn.executemany(UPSERT_DOC_SQL, [
+            (url, title, content, content_hash, now) for title, url, content, content_hash in batch
+        ])
+
+async def write_results(db: Database, results: asyncio.Queue, flush_size: int = WRITE_BATCH_SIZE):
+    """
+    Single writer: drains fetched pages from the queue and writes them in batches until the sentinel.
+    Batches are written in a worker thread so a commit (or a wait on busy_timeout) doesn't stall the event loop.
+    """
+    batch = []
+    while (item := await results.get()) is not None:
+        batch.append(item)
+        if len(batch) >= flush_size:
+            await asyncio.to_thread(write_batch, db, batch)
+            batch = []
+    if batch:
+        await asyncio.to_thread(write_batch, db, batch)
+
+def ensure_schema(db: Database):
+    """Creates the docs table and its FTS index. Steps already applied are skipped via PRAGMA user_version."""
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    if version < 1:
+        # Ensure table exists with FTS (databases created before versioning already have it)
+        if "docs" not in db.table_names():
+            db["docs"].create({
+                "url": str,
+                "title": str,
+                "content": str,
+                "content_hash": str,
+                "last_updated": str,
+            }, pk="url")
+            db["docs"].enable_fts(["title", "content"], create_triggers=True, tokenize="trigram")
+
+    if version < 2:
+        # get_capability_page looks pages up by exact title
+        db.execute("CREATE INDEX IF NOT EXISTS idx_docs_title ON docs(title)")
+
+    if version < 3:
+        # Databases created before versioning may carry a unicode61 FTS index, which misses
+        # substrings like "2.5" or "flash"; rebuild it with the trigram tokenizer
+        fts_sql = db.execute("SELECT sql FROM sqlite_master WHERE name = 'docs_fts'").fetchone()
+        if fts_sql is None or "trigram" not in fts_sql[0]:
+            if fts_sql is not None:
+                db["docs"].disable_fts()
+            db["docs"].enable_fts(["title", "content"], create_triggers=True, tokenize="trigram")
+
+    db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    logger.info(f"Database schema migrated from version {version} to {SCHEMA_VERSION}")
 
-async def ingest_docs():
-    """Main ingestion function to be called on server startup."""
+def init_db():
+    """Creates the database file and schema, so read-only connections can open it before ingestion runs."""
+    db = Database(connect_writer())
+    try:
+        ensure_schema(db)
+    finally:
+        db.close()
+
+async def ingest_docs() -> bool:
+    """Main ingestion function to be called on server startup. Returns False if it had to abort."""
     logger.info("Starting documentation ingestion...")
-    db = Database(DB_PATH)
-    
-    # Ensure table exists with FTS
-    if "docs" not in db.table_names():
-        db["docs"].create({
-            "url": str,
-            "title": str,
-            "content": str,
-            "content_hash": str,
-            "last_updated": str,
-        }, pk="url")
-        db["docs"].enable_fts(["title", "content"], create_triggers=True, tokenize="trigram")
-
-    async with httpx.AsyncClient() as client:
-        llms_txt_content = await fetch_url(client, LLMS_TXT_URL)
-        if not llms_txt_content:
-            logger.error("Failed to fetch llms.txt. Aborting ingestion.")
-            return
-
-        links = parse_llms_txt(llms_txt_content)
-        logger.info(f"Found {len(links)} links in llms.txt")
-
-        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-        tasks = [process_link(client, db, title, url, semaphore) for title, url in links]
-        await asyncio.gather(*tasks)
+    # Ingestion owns the single write connection; tool handlers read through the pool
+    db = Database(connect_writer())
+    try:
+        ensure_schema(db)
+
+        # HTTP/2 multiplexes the page fetches over a few connections instead of one TLS handshake each
+        async with httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENT_REQUESTS,
+                max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+            ),
+            timeout=httpx.Timeout(30.0, connect=5.0),
+        ) as client:
+            llms_txt_content = await fetch_url(client, LLMS_TXT_URL)
+            if not llms_txt_content:
+                logger.error("Failed to fetch llms.txt. Aborting ingestion.")
+                return False
+
+            links = parse_llms_txt(llms_txt_content)
+            logger.info(f"Found {len(links)} links in llms.txt")
+
+            # One sequential scan up front instead of a point lookup per link
+            existing_hashes = dict(db.execute("SELECT url, content_hash FROM docs").fetchall())
+
+            # Pipeline: fetch (network) -> parse + hash (threads) -> write (single writer)
+            links_queue: asyncio.Queue = asyncio.Queue()
+            for title, url in links:
+                links_queue.put_nowait((title, url))
+            for _ in range(MAX_CONCURRENT_REQUESTS):
+                links_queue.put_nowait(None)
+            pages: asyncio.Queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+            results: asyncio.Queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+
+            async def fetch_stage():
+                await asyncio.gather(*(fetch_worker(client, links_queue, pages) for _ in range(MAX_CONCURRENT_REQUESTS)))
+                for _ in range(PARSE_WORKERS):
+                    await pages.put(None)  # End of stream for each parser
+
+            async def parse_stage():
+                await asyncio.gather(*(parse_worker(pages, results, existing_hashes) for _ in range(PARSE_WORKERS)))
+                await results.put(None)  # End of stream for the writer
+
+            stages = [
+                asyncio.create_task(fetch_stage()),
+                asyncio.create_task(parse_stage()),
+                asyncio.create_task(write_results(db, results)),
+            ]
+            try:
+                await asyncio.gather(*stages)
+            except BaseException:
+                # A failed stage leaves the others blocked on the bounded queues forever; stop them too
+                for stage in stages:
+                    stage.cancel()
+                await asyncio.gather(*stages, return_exceptions=True)
+                raise
+
+        # Refresh planner statistics so lookups keep using the title index
+        db.conn.executescript("ANALYZE docs; PRAGMA optimize;")
+    finally:
+        db.close()
 
     logger.info("Documentation ingestion complete.")
+    return True
 
 if __name__ == "__main__":
-    asyncio.run(ingest_docs())
+    if not asyncio.run(ingest_docs()):
+        sys.exit(1)
@@ -0,0 +1,20 @@
+import functools
+import re
+
+# Whitespace-delimited tokens that contain a dot, e.g. "2.5" or "gemini-2.5-flash"
+_DOT_RE = re.compile(r'\S*\.\S*')
+# Escapes existing double quotes by doubling them (" -> "")
+_QUOTE_TABLE = str.maketrans({'"': '""'})
+
+def _quote_token(match: re.Match) -> str:
+    return '"' + match.group(0).translate(_QUOTE_TABLE) + '"'
+
+@functools.lru_cache(maxsize=256)
+def sanitize_term(query: str) -> str:
+    """
+    Fixes 'syntax error near "."' by wrapping terms with dots in double quotes.
+    For standard FTS5 (even with trigram), "2.5" is treated as a valid phrase,
+    whereas 2.5 raw is treated as broken syntax.
+    """
+    # If a term contains a dot, it MUST be quoted to pass the FTS5 parser.
+    return _DOT_RE.sub(_quote_token, query)
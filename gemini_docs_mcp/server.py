@@ -1,69 +1,241 @@
 import os
 import logging
+import time
+from contextlib import ExitStack
 from fastmcp import FastMCP
 from contextlib import asynccontextmanager
 import asyncio
-from .ingest import ingest_docs
+from .ingest import DOCS_URL_PREFIX, ingest_docs, init_db
 from sqlite_utils import Database
 from pydantic import Field
-from typing import List
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 from .config import DB_PATH
+from .db import READ_POOL_SIZE, get_pool
+from .query import sanitize_term
 from typing import Annotated
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# SQL used by the tools. Each pooled connection keeps these few statements in sqlite3's
+# prepared-statement cache (keyed by SQL text), so they are compiled once per connection.
+HAS_DOCS_SQL = "SELECT 1 FROM docs LIMIT 1"
+GET_BY_TITLE_SQL = "SELECT content FROM docs WHERE title = ?"
+GET_BY_ROWID_SQL = "SELECT content FROM docs WHERE rowid = ?"
+LIST_TITLES_SQL = "SELECT title FROM docs ORDER BY title"
+MODELS_BY_TITLE_SQL = "SELECT rowid FROM docs_fts WHERE docs_fts MATCH ? ORDER BY rank LIMIT 1"
+MODELS_BY_URL_SQL = "SELECT rowid FROM docs WHERE url GLOB ? LIMIT 1"
+WARM_FTS_SQL = "SELECT count(*) FROM docs_fts WHERE docs_fts MATCH ?"
+
+# Common terms that pull the title and content parts of the FTS index into memory
+FTS_WARMUP_TERMS = ('title: "gemini"', 'content: "model"', 'content: "api"')
+
+# Ranks hits with bm25, weighting title matches above content matches.
+# docs_fts is an external-content table, so the join back to docs is a rowid probe.
+SEARCH_SQL = """
+SELECT docs.url, docs.title, docs.content
+FROM docs_fts
+JOIN docs ON docs.rowid = docs_fts.rowid
+WHERE docs_fts MATCH ?
+ORDER BY bm25(docs_fts, 5.0, 1.0)
+LIMIT ?
+"""
+
+async def _run_ingestion_once():
+    """Runs one ingestion and refreshes the cached tool results afterwards."""
+    # Don't block startup if ingestion fails - server should be usable even without fresh data
+    try:
+        logger.info("Starting background documentation ingestion...")
+        await ingest_docs()
+        logger.info("Documentation ingestion completed")
+    except Exception as e:
+        logger.error(f"Ingestion failed (server will continue): {e}", exc_info=True)
+    finally:
+        # Rows may have changed even if ingestion failed part-way
+        refresh_caches()
+        _ingestion_done.set()
+        try:
+            await asyncio.to_thread(warm_read_pool)
+        except Exception as e:
+            logger.warning(f"Failed to warm the read pool: {e}")
+
+def warm_read_pool():
+    """Runs a few FTS queries on every pooled reader, so the first searches after ingestion hit warm page caches."""
+    start = time.perf_counter()
+    # Hold all connections at once so each one is warmed, not the same idle one repeatedly
+    with ExitStack() as stack:
+        readers = [stack.enter_context(get_pool().acquire()) for _ in range(READ_POOL_SIZE)]
+        for db in readers:
+            for term in FTS_WARMUP_TERMS:
+                db.execute(WARM_FTS_SQL, [term]).fetchone()
+    logger.info(f"Warmed the FTS index on {len(readers)} read connections in {time.perf_counter() - start:.3f}s")
+
 @asynccontextmanager
 async def server_lifespan(server: FastMCP):
     """Lifespan context manager for the FastMCP server."""
     logger.info("Server starting up...")
+    # The database directory is created once when DB_PATH is resolved in config
     logger.info(f"Database path: {DB_PATH}")
-    
-    # Ensure database directory exists
-    from pathlib import Path
-    db_path_obj = Path(DB_PATH)
-    db_path_obj.parent.mkdir(parents=True, exist_ok=True)
-    logger.info(f"Database directory ready: {db_path_obj.parent}")
-    
+    init_db()
+    pool = get_pool()
+    pool.warm()
+
     # Run ingestion in background so the server can start quickly (important for Cloud Run)
-    # Don't block startup if ingestion fails - server should be usable even without fresh data
-    async def run_ingestion_safely():
-        try:
-            logger.info("Starting background documentation ingestion...")
-            await ingest_docs()
-            logger.info("Documentation ingestion completed")
-        except Exception as e:
-            logger.error(f"Ingestion failed (server will continue): {e}", exc_info=True)
-    
-    # Start ingestion in background without blocking
-    asyncio.create_task(run_ingestion_safely())
+    asyncio.create_task(_run_ingestion_once())
     logger.info("Server ready, ingestion running in background")
     yield
     logger.info("Server shutting down...")
+    pool.close()
 
-def sanitize_term(query):
-    """
-    Fixes 'syntax error near "."' by wrapping terms with dots in double quotes.
-    For standard FTS5 (even with trigram), "2.5" is treated as a valid phrase,
-    whereas 2.5 raw is treated as broken syntax.
-    """
-    terms = query.split()
-    sanitized = []
-    for term in terms:
-        # If the term contains a dot, it MUST be quoted to pass the FTS5 parser.
-        # We also escape any existing double quotes by doubling them (" -> "")
-        if '.' in term:
-            safe_term = term.replace('"', '""')
-            sanitized.append(f'"{safe_term}"')
-        else:
-            sanitized.append(term)
-    
-    return " ".join(sanitized)
+# Set once the first background ingestion has finished, successfully or not
+_ingestion_done = asyncio.Event()
+INGESTION_WAIT_SECONDS = 0.5
+
+def has_docs() -> bool:
+    with get_pool().acquire() as db:
+        return db.execute(HAS_DOCS_SQL).fetchone() is not None
+
+async def wait_for_docs():
+    """Gives the first ingestion of a fresh install a moment before a tool answers from an empty table."""
+    if _ingestion_done.is_set():
+        return
+    # A database left by a previous run is served right away
+    if not await asyncio.to_thread(has_docs):
+        try:
+            await asyncio.wait_for(_ingestion_done.wait(), INGESTION_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+# Bumped by refresh_caches(). A lookup that started before the bump read pre-ingestion rows,
+# so its result must not be stored in the freshly cleared caches.
+_cache_generation = 0
+
+# The "Gemini Models" page: its rowid is resolved once, its content refreshed after each ingestion
+_models_rowid: Optional[int] = None
+MODELS_URL_PATTERN = DOCS_URL_PREFIX + "models*"
+_models_page: Optional[str] = None
+
+def find_models_rowid(db: Database) -> Optional[int]:
+    """Looks up the rowid of the "Gemini Models" documentation page."""
+    # We need to find the models page. Based on previous research it might contain "Gemini Models" in title.
+    # Probe the trigram FTS index on the title column rather than scanning with LIKE.
+    row = db.execute(MODELS_BY_TITLE_SQL, ['title: "Gemini Models"']).fetchone()
+    if row:
+        return row[0]
+
+    # Fallback: try to find by URL if we know it (URLs are not part of the FTS index).
+    # An anchored, case-sensitive GLOB is a range scan on the url primary key index;
+    # a leading-% LIKE would scan every row.
+    row = db.execute(MODELS_BY_URL_SQL, [MODELS_URL_PATTERN]).fetchone()
+    if row:
+        return row[0]
+
+    return None
+
+def refresh_models_page() -> Optional[str]:
+    """Re-reads the cached "Gemini Models" page, resolving its rowid first if needed."""
+    global _models_rowid, _models_page
+    generation = _cache_generation
+    with get_pool().acquire() as db:
+        # Upserts keep a page's rowid, so later refreshes are a single primary-key read
+        row = None
+        if _models_rowid is not None:
+            row = db.execute(GET_BY_ROWID_SQL, [_models_rowid]).fetchone()
+        if row is None:
+            _models_rowid = find_models_rowid(db)
+            if _models_rowid is not None:
+                row = db.execute(GET_BY_ROWID_SQL, [_models_rowid]).fetchone()
+    content = row[0] if row else None
+    if generation == _cache_generation:
+        _models_page = content
+    return content
+
+# The master list of page titles, rebuilt only when the docs change
+_titles_blob: Optional[str] = None
+
+def refresh_titles() -> str:
+    """Rebuilds the cached "Available Capabilities" listing."""
+    global _titles_blob
+    generation = _cache_generation
+    with get_pool().acquire() as db:
+        # Return list of all titles (plain tuples, no per-row dict)
+        titles = db.execute(LIST_TITLES_SQL).fetchall()
+    blob = "Available Capabilities:\n" + "\n".join(f"- {t}" for t, in titles)
+    if generation == _cache_generation:
+        _titles_blob = blob
+    return blob
+
+# Tool results, kept until the next ingestion. Only the event loop reads or writes these,
+# so a repeated call is answered without handing off to a worker thread.
+RESULT_CACHE_SIZE = 512
+_search_cache: "OrderedDict[Tuple[str, ...], str]" = OrderedDict()
+_page_cache: "OrderedDict[str, str]" = OrderedDict()
+
+def _lookup(cache: OrderedDict, key) -> Optional[str]:
+    """Returns a cached result and marks it as most recently used."""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _remember(cache: OrderedDict, key, value: str, generation: int) -> str:
+    """Stores a result computed in `generation`, evicting the least recently used entry when full."""
+    if generation == _cache_generation:
+        if len(cache) >= RESULT_CACHE_SIZE:
+            cache.popitem(last=False)
+        cache[key] = value
+    return value
+
+# Prepended to every search result
+WARNING_PREAMBLE = """[!WARNING]
+SDKs: The @google/generative-ai (JavaScript) and google-generativeai (Python) SDKs are legacy. Please migrate to the new @google/genai (JavaScript) and google-genai (Python) SDKs.
+Models: Gemini-1.5 to gemini-2.0 are old legacy models. Use the newer models available."""
+
+def _do_search(queries: Tuple[str, ...]) -> str:
+    """Runs and formats a documentation search."""
+    # Combine optimized queries with OR (if multiple original queries were provided)
+    safe_queries = [sanitize_term(q) for q in queries]
+    combined_query = " OR ".join(f"({q})" for q in safe_queries)
+    logger.debug("Combined query: %s", combined_query)
+
+    with get_pool().acquire() as db:
+        results = db.execute(SEARCH_SQL, [combined_query, DB_TOP_K]).fetchall()
+
+    if not results:
+        return "No matching documentation found."
+
+    return WARNING_PREAMBLE + "\n\n---\n\n".join(
+        f"# [{title}]({url})\n{content}\n" for url, title, content in results
+    )
+
+def _do_get(capability: str) -> str:
+    """Looks up a page by exact title."""
+    with get_pool().acquire() as db:
+        # Search by title. Since title isn't PK, we use a query.
+        # Assuming titles are unique enough for this purpose.
+        row = db.execute(GET_BY_TITLE_SQL, [capability]).fetchone()
+    if row:
+        return row[0]
+    return f"Capability '{capability}' not found."
+
+def refresh_caches():
+    """Drops cached tool results and rebuilds the models page and title list after the docs changed."""
+    global _cache_generation
+    _cache_generation += 1
+    _search_cache.clear()
+    _page_cache.clear()
+    try:
+        refresh_models_page()
+        refresh_titles()
+    except Exception as e:
+        logger.error(f"Failed to refresh cached pages: {e}", exc_info=True)
+
+DB_TOP_K = 3
 
 # Initialize FastMCP server with lifespan
 mcp = FastMCP("Gemini API Docs", lifespan=server_lifespan)
-DB_TOP_K = 3
 
 @mcp.tool(
     name="search_documentation",
@@ -72,7 +244,7 @@ CRITICAL: This is a naive keyword search, NOT semantic. Long queries will FAIL.
 You MUST use VERY SHORT keyword based queries (max 1-3 keywords) focusing only on the most unique terms.
 Break complex questions into separate, simple queries. It will return the full documentation page for a capability or feature."""
 )
-def search_documentation(queries: Annotated[
+async def search_documentation(queries: Annotated[
         List[str],
         Field(
             description="""List of up to 3 SHORT keyword queries. Keep each query under 3 words.
@@ -81,28 +253,15 @@ GOOD: ['function calling', 'imagen parameters', 'save bytes'] (broad, likely to
         ),
     ]) -> str:
     """Performs a full-text search on Gemini documentation for the given queries. Optimize queries for Full Text Searches."""
-    db = Database(DB_PATH)
-    
-    # Combine optimized queries with OR (if multiple original queries were provided)
-    safe_queries = [sanitize_term(q) for q in queries]
-    combined_query = " OR ".join(f"({q})" for q in safe_queries)
-    print(f"Combined query: {combined_query}")
-
-    
-    results = list(db["docs"].search(combined_query, limit=DB_TOP_K))
-    
-    if not results:
-        return "No matching documentation found."
-
-    formatted_results = []
-    for r in results:
-        formatted_results.append(f"# [{r['title']}]({r['url']})\n{r['content']}\n")
-    
-    final_content = """[!WARNING]
-SDKs: The @google/generative-ai (JavaScript) and google-generativeai (Python) SDKs are legacy. Please migrate to the new @google/genai (JavaScript) and google-genai (Python) SDKs.
-Models: Gemini-1.5 to gemini-2.0 are old legacy models. Use the newer models available."""
-
-    return final_content + "\n\n---\n\n".join(formatted_results)
+    await wait_for_docs()
+    # OR ignores order and surrounding whitespace, so those variants share one cache entry.
+    # Case is kept: FTS5 operators (OR, AND, NOT, NEAR) only work in upper case.
+    key = tuple(sorted(q.strip() for q in queries))
+    if (cached := _lookup(_search_cache, key)) is not None:
+        return cached
+    generation = _cache_generation
+    # The key only identifies the entry; the search runs on the caller's queries
+    return _remember(_search_cache, key, await asyncio.to_thread(_do_search, tuple(queries)), generation)
 
 @mcp.tool(
     name="get_capability_page",
@@ -110,7 +269,7 @@ Models: Gemini-1.5 to gemini-2.0 are old legacy models. Use the newer models ava
 You can call can this tool WITHOUT arguments first to see a master list of all available page titles.
 Then, call it again with the exact title you need.""",
 )
-def get_capability_page(capability: Annotated[
+async def get_capability_page(capability: Annotated[
         str,
         Field(
             description="The EXACT title of the documentation page to retrieve (case-sensitive). If you do not know the exact title, OMIT this argument to receive a master list of all available titles.",
@@ -119,47 +278,30 @@ def get_capability_page(capability: Annotated[
     """
     Returns documentation for a specific capability, or a list of available capabilities.
     """
-    db = Database(DB_PATH)
-    
+    await wait_for_docs()
     if capability:
+        if (cached := _lookup(_page_cache, capability)) is not None:
+            return cached
+        generation = _cache_generation
         try:
-            # Search by title. Since title isn't PK, we use a query.
-            # Assuming titles are unique enough for this purpose.
-            rows = list(db.query("SELECT content FROM docs WHERE title = ?", [capability]))
-            if rows:
-                return rows[0]["content"]
-            else:
-                return f"Capability '{capability}' not found."
+            return _remember(_page_cache, capability, await asyncio.to_thread(_do_get, capability), generation)
         except Exception as e:
             return f"Error retrieving capability: {e}"
     else:
-        # Return list of all titles
-        titles = [row["title"] for row in db.query("SELECT title FROM docs ORDER BY title")]
-        return "Available Capabilities:\n" + "\n".join([f"- {t}" for t in titles])
+        return _titles_blob or await asyncio.to_thread(refresh_titles)
 
 @mcp.tool(
     name="get_current_model",
     description="Shortcut tool to explicitly retrieve the canonical 'Gemini Models' documentation page. Use this to fast-track finding details about available model variants (Pro, Flash, etc.), their capabilities, versioning, and context window sizes.",
 )
-def get_current_model() -> str:
+async def get_current_model() -> str:
     """Returns documentation for current Gemini models."""
-    db = Database(DB_PATH)
-    # We need to find the models page. Based on previous research it might contain "Gemini Models" in title.
-    # Let's try to find it dynamically or hardcode if we are sure.
-    # For now, let's search for a likely title.
+    await wait_for_docs()
     try:
-        rows = list(db.query("SELECT content FROM docs WHERE title LIKE '%Gemini Models%' LIMIT 1"))
-        if rows:
-            return rows[0]["content"]
-        
-        # Fallback: try to find by URL if we know it
-        rows = list(db.query("SELECT content FROM docs WHERE url LIKE '%/models%' LIMIT 1"))
-        if rows:
-             return rows[0]["content"]
-             
-        return "Gemini Models documentation page not found."
+        content = _models_page or await asyncio.to_thread(refresh_models_page)
     except Exception as e:
         return f"Error retrieving models documentation: {e}"
+    return content or "Gemini Models documentation page not found."
 
 def main():
     # If PORT is set, run as HTTP server (for Cloud Run)
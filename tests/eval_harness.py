@@ -1,37 +1,76 @@
 import asyncio
 import json
 import os
-import subprocess
 import sys
-import shutil
 import argparse
+import random
 import re
 import datetime
+import functools
+import hashlib
+import io
+import httpx
 from google import genai
 from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from typing import Dict, Any, List, Optional
+from mcp.client.stdio import get_default_environment, stdio_client
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 # Configuration
 MODEL_NAME = "gemini-flash-latest"
 PROMPTS_FILE = "tests/test_prompts.json"
 GENERATED_DIR = "tests/generated"
 RESULT_FILE = "tests/result.json"
+# Execution outcomes of previously generated code, keyed by test id and prompt
+CACHE_FILE = "tests/.eval_cache.json"
+# Test cases in flight at once; generation and execution are network/subprocess bound
+MAX_CONCURRENT_TESTS = 8
+# Gemini requests started per minute across all concurrent tests (stay under the API quota)
+REQUESTS_PER_MINUTE = int(os.environ.get("EVAL_REQUESTS_PER_MINUTE", "60"))
+# Keep-alive pool of the shared HTTP client used for every generate_content call
+MAX_HTTP_CONNECTIONS = 32
+# Generated scripts executed at once, and how long each may run
+MAX_CONCURRENT_EXECUTIONS = os.cpu_count() or 1
+EXECUTION_TIMEOUT = 60
+# Environment for generated scripts, built once (subprocesses don't modify it).
+# Crucial: Add current directory to PYTHONPATH so 'python3 -m gemini_docs_mcp.server' works
+_CHILD_ENV = {**os.environ, 'PYTHONPATH': os.getcwd() + os.pathsep + os.environ.get('PYTHONPATH', '')}
+
+# stdio_client only passes a minimal default environment to the server; forward the
+# variables that choose its database so the prewarm and the server use the same file
+_DB_ENV_VARS = ("GEMINI_DOCS_DB_PATH", "K_SERVICE", "CONTAINER")
 
 server_params = StdioServerParameters(
     command="python3",  # Executable
     args=["-m", "gemini_docs_mcp.server"],  # MCP Server
-    env=None,  # Optional environment variables
+    env={k: os.environ[k] for k in _DB_ENV_VARS if k in os.environ},  # Optional environment variables
 )
 
+class CachedToolsSession(ClientSession):
+    """
+    ClientSession that fetches the server's tool list once.
+    The genai SDK calls list_tools() on every generate_content request that passes the session,
+    and the tools of this server don't change during a run.
+    """
+
+    _tools = None
+
+    async def list_tools(self, *args, **kwargs):
+        if args or kwargs:
+            return await super().list_tools(*args, **kwargs)
+        if self._tools is None:
+            self._tools = await super().list_tools()
+        return self._tools
+
 # --- Code Extraction & Analysis Utils ---
 
+_PY_BLOCK_RE = re.compile(r'```python\n.*?\n\s*```', re.DOTALL)
+_TS_BLOCK_RE = re.compile(r'```(?:typescript|javascript)\n.*?\n\s*```', re.DOTALL)
+# Any fenced block; the info string (language tag) line is not part of the code
+_CODE_FENCE_RE = re.compile(r'```[^\n]*\n(.*?)```', re.DOTALL)
+
 def extract_code_py(response_str: str) -> str:
     """Extracts code for the given language from the response."""
-    re_pattern = rf'```python\n.*?\n\s*```'
-    compiled_pattern = re.compile(re_pattern, re.DOTALL)
-
-    if found := compiled_pattern.findall(response_str):
+    if found := _PY_BLOCK_RE.findall(response_str):
         found = [s.strip() for s in found]
         if len(found) == 1:
             return found[0].replace("```python", "").replace("```", "").strip()
@@ -44,6 +83,7 @@ def extract_code_py(response_str: str) -> str:
     else:
         return response_str.strip()
 
+@functools.lru_cache(maxsize=256)
 def dedent_code_str(code_str: str) -> str:
     """Dedents the given code string."""
     code_str_lines = code_str.split('\n')
@@ -59,10 +99,7 @@ def dedent_code_str(code_str: str) -> str:
 
 def extract_code_ts(response_str: str) -> str:
     """Extracts code for the given language from the response."""
-    re_pattern = rf'```(?:typescript|javascript)\n.*?\n\s*```'
-    compiled_pattern = re.compile(re_pattern, re.DOTALL)
-
-    if found := compiled_pattern.findall(response_str):
+    if found := _TS_BLOCK_RE.findall(response_str):
         found = [s.strip() for s in found]
 
         result_str_list = []
@@ -90,9 +127,9 @@ def extract_code(response_str: str, lang: str) -> str:
     elif lang == 'typescript':
         return extract_code_ts(response_str)
     else:
-        # Fallback for unspecified or other languages
-        if "```" in response_str:
-             return response_str.split("```")[1].strip()
+        # Fallback for unspecified or other languages: body of the first fenced block, if any
+        if m := _CODE_FENCE_RE.search(response_str):
+            return m.group(1).strip()
         return response_str.strip()
 
 OLD_PY_SDK_KEYWORDS = {
@@ -102,11 +139,14 @@ OLD_PY_SDK_KEYWORDS = {
     'model.start_chat',
     'model.generate_content',
 }
+# One scan for all keywords instead of one substring search each
+_OLD_PY_SDK_RE = re.compile('|'.join(map(re.escape, OLD_PY_SDK_KEYWORDS)))
+_NEW_PY_SDK_RE = re.compile(r'from google import genai|import google\.genai')
 
 def check_sdk_version_py(code_str):
-    if any(keyword in code_str for keyword in OLD_PY_SDK_KEYWORDS):
+    if _OLD_PY_SDK_RE.search(code_str):
         return 'old_sdk'
-    if 'from google import genai' in code_str or 'import google.genai' in code_str:
+    if _NEW_PY_SDK_RE.search(code_str):
         return 'new_sdk'
     return 'no_sdk'
 
@@ -118,9 +158,10 @@ OLD_TS_SDK_KEYWORDS = {
     'model.startChat',
     'model.generateContent',
 }
+_OLD_TS_SDK_RE = re.compile('|'.join(map(re.escape, OLD_TS_SDK_KEYWORDS)))
 
 def check_sdk_version_ts(code_str):
-    if any(keyword in code_str for keyword in OLD_TS_SDK_KEYWORDS):
+    if _OLD_TS_SDK_RE.search(code_str):
         return 'old_sdk'
     if '@google/genai' in code_str:
         return 'new_sdk'
@@ -137,19 +178,46 @@ def analyze_code(code: str, lang: str) -> str:
 # --- Harness Core ---
 
 def setup_directories():
-    if os.path.exists(GENERATED_DIR):
-        shutil.rmtree(GENERATED_DIR)
-    os.makedirs(GENERATED_DIR)
-
+    # Scripts from the previous run are overwritten in place; leftovers are pruned at the end
+    os.makedirs(GENERATED_DIR, exist_ok=True)
+
+def prune_generated(keep: set):
+    """Removes generated scripts that no test of this run produced."""
+    with os.scandir(GENERATED_DIR) as entries:
+        for entry in entries:
+            path = os.path.join(GENERATED_DIR, entry.name)
+            if path not in keep and entry.is_file():
+                os.remove(path)
+
+@functools.lru_cache(maxsize=1)
 def load_prompts() -> List[Dict[str, Any]]:
     with open(PROMPTS_FILE, 'r') as f:
         return json.load(f)
 
-async def generate_code(prompt:str, language: str, client:genai.Client, mcp_session:ClientSession, retries=3) -> str:
-    print(f"Generating code for ({language}): {prompt[:50]}...")
+RETRYABLE_ERRORS = ["500", "502", "503", "504", "Internal", "DeadlineExceeded", "429", "RESOURCE_EXHAUSTED"]
+
+class RateLimiter:
+    """Spaces out calls so that at most `per_minute` of them start in any minute, across all tests."""
+
+    def __init__(self, per_minute: int):
+        self._interval = 60 / per_minute
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._interval
+        if wait > 0:
+            await asyncio.sleep(wait)
 
+_rate_limiter = RateLimiter(REQUESTS_PER_MINUTE)
+
+async def generate_code(prompt:str, language: str, client:genai.Client, mcp_session:ClientSession, retries=3) -> str:
     for attempt in range(retries + 1):
         try:
+            await _rate_limiter.acquire()
             # Use a model that's good at coding. 
             response = await client.aio.models.generate_content(
                 model=MODEL_NAME,
@@ -162,53 +230,170 @@ async def generate_code(prompt:str, language: str, client:genai.Client, mcp_sess
             return extract_code(response.text, language)
         except Exception as e:
             error_str = str(e)
-            # Retry on 5XX errors or generic "Internal" errors
-            is_5xx = any(code in error_str for code in ["500", "502", "503", "504", "Internal", "DeadlineExceeded"])
-            if attempt < retries and is_5xx:
-                wait_time = (attempt + 1) * 2 # Simple backoff: 2s, 4s, 6s
-                print(f"  WARNING: API error (attempt {attempt+1}/{retries+1}): {e}. Retrying in {wait_time}s...")
+            # Retry on 5XX errors, generic "Internal" errors and rate limiting (429)
+            is_retryable = any(code in error_str for code in RETRYABLE_ERRORS)
+            if attempt < retries and is_retryable:
+                # Exponential backoff (2s, 4s, 8s, ... up to 30s) with jitter, so concurrent tests don't retry in lockstep
+                wait_time = min(30, 2 ** (attempt + 1)) + random.uniform(0, 1)
+                print(f"  WARNING: API error (attempt {attempt+1}/{retries+1}): {e}. Retrying in {wait_time:.1f}s...")
                 await asyncio.sleep(wait_time)
             else:
-                if attempt == retries and is_5xx:
+                if attempt == retries and is_retryable:
                      print(f"  ERROR: Failed after {retries+1} attempts.")
                 raise e
     return ""
 
+def hash_text(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def load_manifest() -> Dict[str, Any]:
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(manifest: Dict[str, Any]):
+    # Write to a temp file and swap it in, so an interrupted run can't leave a truncated manifest
+    tmp_path = CACHE_FILE + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, CACHE_FILE)
+
 def save_code(code: str, test_id: str, language: str) -> str:
     ext = "py" if language == "python" else "ts"
     file_path = os.path.join(GENERATED_DIR, f"{test_id}.{ext}")
-    with open(file_path, 'w') as f:
+    # Leave the file (and its mtime) alone when the model produced the same code as last run
+    try:
+        with open(file_path, 'r') as f:
+            if f.read() == code:
+                return file_path
+    except FileNotFoundError:
+        pass
+    # Write a temp file and swap it in, so a script is never seen (or executed) half-written
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, 'w') as f:
         f.write(code)
+    os.replace(tmp_path, file_path)
     return file_path
 
-def execute_code(file_path: str) -> tuple[str, str, int]:
-    print(f"Executing: {file_path}...")
-    # Crucial: Add current directory to PYTHONPATH so 'python3 -m gemini_docs_mcp.server' works
-    env = os.environ.copy()
-    env['PYTHONPATH'] = os.getcwd() + os.pathsep + env.get('PYTHONPATH', '')
-    
-    try:
-        # 30 second timeout to prevent hangs
-        result = subprocess.run(
-            [sys.executable, file_path],
-            capture_output=True,
-            text=True,
-            env=env,
-            timeout=60
-        )
-        return result.stdout, result.stderr, result.returncode
-    except subprocess.TimeoutExpired:
-        return "", "Execution timed out (60s)", -1
-    except Exception as e:
-        return "", str(e), -1
+async def execute_code(file_path: str, sem: asyncio.Semaphore, log: io.StringIO) -> tuple[str, str, int]:
+    # At most one generated script per CPU runs at a time
+    async with sem:
+        print(f"Executing: {file_path}...", file=log)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, file_path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=_CHILD_ENV,
+            )
+        except Exception as e:
+            return "", str(e), -1
 
-def validate_execution_result(stdout: str, stderr: str, returncode: int) -> bool:
+        try:
+            # 60 second timeout to prevent hangs
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=EXECUTION_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return "", f"Execution timed out ({EXECUTION_TIMEOUT}s)", -1
+        return stdout.decode(errors="replace"), stderr.decode(errors="replace"), proc.returncode
+
+# Exits 0 when the server's database already holds ingested pages
+_HAS_DOCS_CHECK = """
+import sqlite3, sys
+from gemini_docs_mcp.config import DB_PATH
+try:
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    sys.exit(0 if conn.execute("SELECT 1 FROM docs LIMIT 1").fetchone() else 1)
+except sqlite3.Error:
+    sys.exit(1)
+"""
+
+async def prewarm_docs_db():
+    """
+    Runs one ingestion before any test starts, so the harness's own MCP server answers the
+    first tool calls from a populated database instead of racing its background ingestion
+    (the generated scripts only use the genai SDK and never start a server).
+    Skipped when the database already has pages; the server refreshes those on startup anyway.
+    """
+    # Same interpreter and environment as stdio_client(server_params), so both resolve the same DB_PATH
+    env = get_default_environment() | (server_params.env or {})
+
+    async def run(*args: str) -> int:
+        proc = await asyncio.create_subprocess_exec(server_params.command, *args, env=env)
+        return await proc.wait()
+
+    if await run("-c", _HAS_DOCS_CHECK) == 0:
+        print("Documentation database already populated; skipping prewarm")
+        return
+    print("Prewarming documentation database...")
+    if await run("-m", "gemini_docs_mcp.ingest") != 0:
+        print("  WARNING: Prewarm ingestion failed; the MCP server will ingest on startup instead")
+
+def validate_execution_result(stdout: str, stderr: str, returncode: int, log: io.StringIO) -> bool:
     if returncode != 0:
-        print(f"  FAILED (Execution): Non-zero return code {returncode}")
-        print(f"  STDERR: {stderr.strip()}")
+        print(f"  FAILED (Execution): Non-zero return code {returncode}", file=log)
+        print(f"  STDERR: {stderr.strip()}", file=log)
         return False
     return True
 
+async def run_test(test_case: Dict[str, Any], mode: str, generate: Callable[[str, str], Awaitable[str]], execute_sem: asyncio.Semaphore, manifest: Dict[str, Any]) -> tuple[str, Dict[str, Any]]:
+    """Evaluates one test case, printing its log in one piece once it is done."""
+    log = io.StringIO()
+    try:
+        return await evaluate_test(test_case, mode, generate, execute_sem, manifest, log)
+    finally:
+        # One write per test keeps the output of concurrent tests from interleaving
+        sys.stdout.write(log.getvalue())
+
+async def evaluate_test(test_case: Dict[str, Any], mode: str, generate: Callable[[str, str], Awaitable[str]], execute_sem: asyncio.Semaphore, manifest: Dict[str, Any], log: io.StringIO) -> tuple[str, Dict[str, Any]]:
+    """Generates, saves and evaluates the code for one test case."""
+    test_id = test_case.get('id', 'unknown')
+    language = test_case.get('language', 'python') # Default to python if missing
+
+    print(f"\nTest: {test_id} ({language})", file=log)
+    try:
+        print(f"Generating code for ({language}): {test_case['prompt'][:50]}...", file=log)
+        code = await generate(test_case['prompt'], language)
+        script_path = save_code(code, test_id, language)
+
+        if mode == 'static':
+            analysis_result = analyze_code(code, language)
+            passed = (analysis_result == 'new_sdk')
+            print(f"  Analysis: {analysis_result} -> {'PASSED' if passed else 'FAILED'}", file=log)
+            return test_id, {"passed": passed, "analysis": analysis_result, "script": script_path}
+
+        elif mode == 'execute':
+            if language == 'python':
+                # Code on the legacy SDK fails the eval whatever it does at runtime; don't spend a subprocess on it
+                analysis_result = analyze_code(code, language)
+                if analysis_result == 'old_sdk':
+                    print("  Execution -> FAILED (legacy SDK, not executed)", file=log)
+                    return test_id, {"passed": False, "analysis": analysis_result, "script": script_path}
+
+                # The same code already passed for this prompt: skip running it again
+                cache_key = f"{test_id}:{hash_text(test_case['prompt'])}"
+                code_hash = hash_text(code)
+                cached = manifest.get(cache_key)
+                if cached and cached["code_hash"] == code_hash and cached["passed"]:
+                    print("  Execution -> PASSED (cached)", file=log)
+                    return test_id, {"passed": True, "script": script_path}
+
+                stdout, stderr, returncode = await execute_code(script_path, execute_sem, log)
+                passed = validate_execution_result(stdout, stderr, returncode, log)
+                manifest[cache_key] = {"code_hash": code_hash, "passed": passed}
+                print(f"  Execution -> {'PASSED' if passed else 'FAILED'}", file=log)
+                return test_id, {"passed": passed, "script": script_path}
+            else:
+                print(f"  SKIPPED (Execution not supported for {language})", file=log)
+                return test_id, {"passed": None, "status": "skipped_execution", "script": script_path}
+
+    except Exception as e:
+        print(f"  ERROR during test execution: {e}", file=log)
+        return test_id, {"passed": False, "error": str(e)}
+
 async def main():
     parser = argparse.ArgumentParser(description="Gemini Docs MCP Eval Harness")
     parser.add_argument('--mode', choices=['execute', 'static'], default='static', help='Evaluation mode')
@@ -216,43 +401,43 @@ async def main():
 
     setup_directories()
     prompts = load_prompts()
-    client = genai.Client()
-    
+    manifest = load_manifest()
+
     results = {}
-    
-    print(f"=== Starting Evaluation (Mode: {args.mode}) ===")
 
-    async with stdio_client(server_params) as (read, write):
-      async with ClientSession(read, write) as session:
+    print(f"=== Starting Evaluation (Mode: {args.mode}) ===")
+    await prewarm_docs_db()
+
+    # One pooled HTTP/2 client for all Gemini calls, so concurrent tests reuse connections and TLS sessions
+    async with httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=MAX_HTTP_CONNECTIONS, max_keepalive_connections=MAX_HTTP_CONNECTIONS),
+    ) as http_client, stdio_client(server_params) as (read, write):
+      async with CachedToolsSession(read, write) as session:
         await session.initialize()
-        for test_case in prompts:
-            test_id = test_case.get('id', 'unknown')
-            language = test_case.get('language', 'python') # Default to python if missing
-            
-            print(f"\nTest: {test_id} ({language})")
-            try:
-                code = await generate_code(test_case['prompt'], language, client, session)
-                script_path = save_code(code, test_id, language)
-                
-                if args.mode == 'static':
-                    analysis_result = analyze_code(code, language)
-                    passed = (analysis_result == 'new_sdk')
-                    results[test_id] = {"passed": passed, "analysis": analysis_result, "script": script_path}
-                    print(f"  Analysis: {analysis_result} -> {'PASSED' if passed else 'FAILED'}")
-
-                elif args.mode == 'execute':
-                    if language == 'python':
-                        stdout, stderr, returncode = execute_code(script_path)
-                        passed = validate_execution_result(stdout, stderr, returncode)
-                        results[test_id] = {"passed": passed, "script": script_path}
-                        print(f"  Execution -> {'PASSED' if passed else 'FAILED'}")
-                    else:
-                        print(f"  SKIPPED (Execution not supported for {language})")
-                        results[test_id] = {"passed": None, "status": "skipped_execution"}
-
-            except Exception as e:
-                print(f"  ERROR during test execution: {e}")
-                results[test_id] = {"passed": False, "error": str(e)}
+        client = genai.Client(http_options=genai.types.HttpOptions(httpx_async_client=http_client))
+        # All tests share the one MCP session; its tool calls are multiplexed over the stdio channel
+        sem = asyncio.Semaphore(MAX_CONCURRENT_TESTS)
+        execute_sem = asyncio.Semaphore(MAX_CONCURRENT_EXECUTIONS)
+
+        # Test cases with the same prompt and language share one Gemini call
+        generations: Dict[tuple[str, str], asyncio.Task] = {}
+
+        def generate(prompt: str, language: str) -> Awaitable[str]:
+            key = (prompt, language)
+            if key not in generations:
+                generations[key] = asyncio.create_task(generate_code(prompt, language, client, session))
+            return generations[key]
+
+        async def guarded(test_case):
+            async with sem:
+                return await run_test(test_case, args.mode, generate, execute_sem, manifest)
+
+        for test_id, result in await asyncio.gather(*(guarded(tc) for tc in prompts)):
+            results[test_id] = result
+
+    save_manifest(manifest)
+    prune_generated({r["script"] for r in results.values() if r.get("script")})
 
     print("\n=== Evaluation Summary ===")
     passed_count = sum(1 for r in results.values() if r.get('passed') is True)
@@ -1,29 +1,41 @@
 from sqlite_utils import Database
 import sys
 from gemini_docs_mcp.config import DB_PATH
-from gemini_docs_mcp.server import search_documentation
+from gemini_docs_mcp.query import sanitize_term
 
+# Same ranking as search_documentation; FTS5 cuts the excerpt from the content column
+# (column 1 of docs_fts), so the full page never leaves SQLite
+SNIPPET_SQL = """
+SELECT docs.title, docs.url, snippet(docs_fts, 1, '', '', '...', 64)
+FROM docs_fts
+JOIN docs ON docs.rowid = docs_fts.rowid
+WHERE docs_fts MATCH ?
+ORDER BY bm25(docs_fts, 5.0, 1.0)
+LIMIT 5
+"""
 
-def test_search(query: str):
-    """Tests FTS search for a given query."""
-    print(f"\n--- Testing search for: '{query}' ---")
+
+def test_search(queries: list[str]):
+    """Tests FTS search for the given queries, combined into one query like the search tool does."""
+    print(f"\n--- Testing search for: {queries} ---")
     try:
         db = Database(DB_PATH)
         if "docs" not in db.table_names():
              print("Error: 'docs' table not found. Has ingestion run?")
              return
 
-        results = search_documentation([query])
+        combined_query = " OR ".join(f"({sanitize_term(q)})" for q in queries)
+        results = db.execute(SNIPPET_SQL, [combined_query]).fetchall()
         if not results:
             print("No results found.")
             return
 
         print(f"Found {len(results)} results (showing top 5):")
-        for i, r in enumerate(results, 1):
+        for i, (title, url, snippet) in enumerate(results, 1):
             print(f"\nResult {i}:")
-            print(f"Title: {r['title']}")
-            print(f"URL: {r['url']}")
-            snippet = r['content'][:200].replace('\n', ' ') + "..."
+            print(f"Title: {title}")
+            print(f"URL: {url}")
+            snippet = snippet.replace('\n', ' ')
             print(f"Snippet: {snippet}")
 
     except Exception as e:
@@ -31,11 +43,8 @@ def test_search(query: str):
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
-        for query in sys.argv[1:]:
-            test_search(query)
+        test_search(sys.argv[1:])
     else:
         # Default test queries if none provided
-        test_search("function calling with gemini")
-        # test_search("embeddings")
-        # test_search("gemini pro")
-        # test_search("api key")
+        test_search(["function calling with gemini"])
+        # test_search(["embeddings", "gemini pro", "api key"])
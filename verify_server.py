@@ -28,9 +28,10 @@ async def run():
             # result = await session.call_tool("get_capability_page", arguments={"capability": "Embeddings"})
             # print("\nget_capability('Embeddings') result (first 500 chars):\n", result.content[0].text[:500])
 
-            # Test search_documentation
-            result = await session.call_tool("search_documentation", arguments={"queries": ["function calling"]})
-            print("\nsearch_documentation('function calling') result (first 500 chars):\n", result.content[0].text[:500])
+            # Test search_documentation (all terms in one round-trip; the server ORs them together)
+            queries = ["function calling", "embeddings", "api key"]
+            result = await session.call_tool("search_documentation", arguments={"queries": queries})
+            print(f"\nsearch_documentation({queries}) result (first 500 chars):\n", result.content[0].text[:500])
 
             # Test get_current_model
             # result = await session.call_tool("get_current_model", arguments={})